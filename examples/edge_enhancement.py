@@ -91,7 +91,7 @@ def main():
     coherent = propagate(
         [source, sample], shape, [15 * q.keV], d, ps, t=0 * q.s, detector=detector
     ).get()
-    coherent *= camera.exp_time.simplified.magnitude
+    coherent *= camera.exp_time_seconds
     # Decimate to fit the effective pixel size of the detector system
     coherent_ld = camera.get_image(coherent, shot_noise=False, amplifier_noise=False)
 
@@ -99,7 +99,7 @@ def main():
     poly = propagate(
         [source, sample], shape, list(range(10, 30)) * q.keV, d, ps, t=0 * q.s, detector=detector
     ).get()
-    poly *= camera.exp_time.simplified.magnitude
+    poly *= camera.exp_time_seconds
     poly_ld = camera.get_image(poly, shot_noise=args.noise, amplifier_noise=args.noise)
 
     # Compute and show some of the used propagators
@@ -38,7 +38,7 @@ def get_flat(
             u *= oe.transfer(shape, detector.pixel_size, e, t=0 * q.s)
         flat = (abs(u) ** 2).get()
         det = detector.convert(flat, e)
-        image += det * detector.camera.exp_time.simplified.magnitude
+        image += det * detector.camera.exp_time_seconds
 
     return detector.camera.get_image(
         image, shot_noise=shot_noise, amplifier_noise=amplifier_noise, psf=psf
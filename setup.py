@@ -17,7 +17,7 @@ setup(
     description="X-ray imaging simulation",
     long_description=open('README.rst').read(),
     install_requires=[
-        'numpy>=1.6.1',
+        'numpy>=1.17',
         'quantities>=0.10.1',
         'pyopencl>=2012.1',
         'reikna',
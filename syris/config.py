@@ -11,6 +11,8 @@ import pyopencl.cltypes as cltypes
 
 LOG = logging.getLogger()
 MAX_META_BODIES = 30
+# Maximum number of Gaussian filters cached per command queue
+MAX_GAUSS_FILTERS = 8
 
 
 class Precision(object):
@@ -58,9 +60,18 @@ class OpenCL(object):
         self.devices = []
         # Default command queue
         self.queue = None
-        self.programs = {"improc": None, "physics": None, "geometry": None, "mesh": None}
+        self.programs = {
+            "improc": None,
+            "physics": None,
+            "geometry": None,
+            "mesh": None,
+            "cameras": None,
+        }
         # {command queue: {shape: plan}} dictionary
         self.fft_plans = {}
+        # {command queue: OrderedDict {(shape, sigma, pixel size, fourier): pyopencl Array}}
+        # dictionary, the least recently used filters are evicted beyond MAX_GAUSS_FILTERS
+        self.gauss_filters = {}
 
 
 def init_logging(level=logging.DEBUG, logger_file=None):
@@ -2,6 +2,7 @@
 import logging
 import pkg_resources
 import numpy as np
+import pyopencl.array as cl_array
 import quantities as q
 import scipy.interpolate as interp
 import syris.gpu.util as gutil
@@ -9,8 +10,15 @@ from syris import config as cfg
 from syris.imageprocessing import bin_image, decimate
 from syris.math import fwnm_to_sigma
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 
 LOG = logging.getLogger(__name__)
+# Poisson distribution mean from which on the shot noise is approximated by a normal distribution
+POISSON_GAUSS_LIMIT = 30
 
 
 def is_fps_feasible(fps, exp_time):
@@ -21,6 +29,46 @@ def is_fps_feasible(fps, exp_time):
     return exp_time <= 1.0 / fps
 
 
+def _apply_shot_noise(electrons, rng):
+    """Replace mean *electrons* in-place by Poisson-distributed random numbers drawn by the numpy
+    random generator *rng*. Means greater or equal to :data:`POISSON_GAUSS_LIMIT` are approximated
+    by a normal distribution, which can be computed without integer temporaries.
+    """
+    small = electrons < POISSON_GAUSS_LIMIT
+    small_counts = rng.poisson(electrons[small])
+
+    noise = rng.standard_normal(electrons.shape, dtype=electrons.dtype)
+    noise *= np.sqrt(electrons)
+    electrons += noise
+    np.rint(electrons, out=electrons)
+    np.maximum(electrons, 0, out=electrons)
+    electrons[small] = small_counts
+
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True)
+    def _emva_numba(photons, out, dark, gain, sigma, max_val, shot_noise):
+        """Convert *photons* to counts in *out* in one parallel pass (see
+        :meth:`Camera.get_image`). *dark* is added to the photons, *gain* converts electrons to
+        counts, *sigma* is the amplifier noise (0 means no noise), the counts are clipped to
+        *max_val* and shot noise is applied if *shot_noise* is True.
+        """
+        photons = photons.ravel()
+        flat = out.ravel()
+        for i in prange(photons.shape[0]):
+            electrons = photons[i] + dark
+            if shot_noise:
+                if electrons < POISSON_GAUSS_LIMIT:
+                    electrons = np.random.poisson(electrons)
+                else:
+                    electrons += np.sqrt(electrons) * np.random.standard_normal()
+                    electrons = max(np.rint(electrons), 0.0)
+            if sigma > 0:
+                electrons += sigma * np.random.standard_normal()
+            flat[i] = np.rint(min(max(gain * electrons, 0.0), max_val))
+
+
 class Camera(object):
 
     """Base class representing a camera."""
@@ -38,6 +86,8 @@ class Camera(object):
         exp_time=1 * q.s,
         fps=1 / q.s,
         dtype=np.ushort,
+        use_numba=False,
+        seed=None,
     ):
         """Create a camera with *pixel_size*, *gain* specifying :math:`\frac{counts}{e^-}`,
         *dark_current* as mean number of electrons present without incident light, *amplifier_sigma*
@@ -47,33 +97,71 @@ class Camera(object):
         Frames Per Second which are generated by the camera (exposure time is independent from fps,
         i.e.  e.g.  fps can be set to 1000 and exposure time to 1 \mu s, but it cannot exceed
         :math:`1/fps` s).  *dtype* is the sensor output data type. If the values given are
-        incompatible, the frame rate is adjusted to the exposure time.
+        incompatible, the frame rate is adjusted to the exposure time. If *use_numba* is True, the
+        noise of host images is computed by numba in one parallel pass, this requires numba to be
+        installed and gives a different random number stream than numpy. *seed* initializes the
+        camera's random number generator (:func:`numpy.random.default_rng`), cameras with the same
+        *seed* produce the same sequence of noisy frames on the host and on the device (the numba
+        random numbers are not affected by it).
         """
         self.pixel_size = pixel_size.simplified
         self.gain = gain
         self.dark_current = dark_current
         self.amplifier_sigma = amplifier_sigma
         self.bpp = bits_per_pixel
-        self._quantum_efficiencies = quantum_efficiencies
-        self._wavelengths = wavelengths
+        self._quantum_efficiencies = None
+        self._wavelengths = None
         self.dtype = dtype
+        self.use_numba = use_numba
         self.shape = shape
         self._last_input_shape = None
         self._psf = None
+        self._rng = np.random.default_rng(seed)
 
-        if self._quantum_efficiencies is not None and self._wavelengths is not None:
-            self._qe_tck = interp.splrep(
-                self._wavelengths.rescale(q.nm).magnitude, self._quantum_efficiencies
+        if quantum_efficiencies is not None and wavelengths is not None:
+            # Keep two contiguous arrays sorted by wavelength, so that the efficiencies can be
+            # evaluated for many wavelengths at once
+            wavelengths = wavelengths.rescale(q.nm)
+            order = np.argsort(wavelengths.magnitude)
+            self._wavelengths = np.ascontiguousarray(wavelengths.magnitude[order]) * q.nm
+            self._quantum_efficiencies = np.ascontiguousarray(
+                np.asarray(quantum_efficiencies, dtype=float)[order]
             )
+            self._qe_tck = interp.splrep(self._wavelengths.magnitude, self._quantum_efficiencies)
+        else:
+            self._quantum_efficiencies = quantum_efficiencies
+            self._wavelengths = wavelengths
         if not is_fps_feasible(fps, exp_time):
-            fps = 1 / exp_time.simplified
-        self._exp_time = exp_time
-        self._fps = fps
+            fps = 1 / exp_time
+        self._set_timing(exp_time, fps)
+
+    @property
+    def dark_current(self):
+        return self._dark_current
+
+    @dark_current.setter
+    def dark_current(self, dark_current):
+        # Converted once here so that get_image adds a plain scalar to every frame
+        self._dark_current = float(dark_current)
+
+    @property
+    def use_numba(self):
+        return self._use_numba
+
+    @use_numba.setter
+    def use_numba(self, use_numba):
+        if use_numba and njit is None:
+            raise ImportError("use_numba requires numba to be installed")
+        self._use_numba = use_numba
 
     @property
     def wavelengths(self):
         return self._wavelengths
 
+    @property
+    def quantum_efficiencies(self):
+        return self._quantum_efficiencies
+
     @property
     def exp_time(self):
         return self._exp_time
@@ -81,10 +169,16 @@ class Camera(object):
     @exp_time.setter
     def exp_time(self, exp_time):
         if not is_fps_feasible(self.fps, exp_time):
-            fmt = "Exposure time {} not possible for FPS {}, setting FPS to {}"
-            LOG.debug(fmt.format(exp_time, self.fps, 1 / exp_time.simplified))
-            self._fps = 1 / exp_time.simplified
-        self._exp_time = exp_time.simplified
+            # Lazy formatting, the message is built only if it is logged
+            LOG.debug(
+                "Exposure time %s not possible for FPS %s, setting FPS to 1 / %s",
+                exp_time,
+                self.fps,
+                exp_time,
+            )
+            self._set_timing(exp_time, 1 / exp_time)
+        else:
+            self._set_timing(exp_time, self.fps)
 
     @property
     def fps(self):
@@ -93,17 +187,41 @@ class Camera(object):
     @fps.setter
     def fps(self, fps):
         if not is_fps_feasible(fps, self.exp_time):
-            fmt = "FPS {} not possible for exposure time {}, setting exposure time to {}"
-            LOG.debug(fmt.format(fps, self.exp_time, 1 / fps.simplified))
-            self._exp_time = 1 / fps.simplified
+            LOG.debug(
+                "FPS %s not possible for exposure time %s, setting exposure time to 1 / %s",
+                fps,
+                self.exp_time,
+                fps,
+            )
+            self._set_timing(1 / fps, fps)
+        else:
+            self._set_timing(self.exp_time, fps)
+
+    @property
+    def exp_time_seconds(self):
+        """Exposure time in seconds as a plain float for usage in loops."""
+        return self._exp_time_seconds
+
+    @property
+    def fps_hertz(self):
+        """Frames per second as a plain float for usage in loops."""
+        return self._fps_hertz
+
+    def _set_timing(self, exp_time, fps):
+        """Set *exp_time* and *fps* and cache their magnitudes in base units."""
+        self._exp_time = exp_time.simplified
         self._fps = fps.simplified
+        self._exp_time_seconds = float(self._exp_time.magnitude)
+        self._fps_hertz = float(self._fps.magnitude)
 
     @property
     def max_grey_value(self):
         return 2 ** self.bpp - 1
 
     def get_quantum_efficiency(self, wavelength):
-        """Get quantum efficiency [dimensionless] at *wavelength*."""
+        """Get quantum efficiency [dimensionless] at *wavelength*, which can also be an array of
+        wavelengths evaluated at once.
+        """
         return interp.splev(wavelength.rescale(q.nm).magnitude, self._qe_tck)
 
     def get_image(self, photons, shot_noise=True, amplifier_noise=True, psf=True, queue=None):
@@ -114,43 +232,129 @@ class Camera(object):
         variance, :math:`\sigma_d^2` is the normal distributed electronics noise variance and
         :math:`\sigma_q^2` is the quantization noise variance. If *shot_noise* is False don't apply
         it. If *amplifier_noise* is False don't apply it as well. If *psf* is False don't apply the
-        point spread function.
+        point spread function. If *photons* are a :class:`pyopencl.array.Array` or they need to be
+        binned and the camera *dtype* is unsigned short, the noise is computed on the device in
+        one pass and only the final counts are transferred to the host. The shot noise is sampled
+        exactly for means below :data:`POISSON_GAUSS_LIMIT` electrons and by the Gaussian
+        approximation above that. If the camera uses numba, the host computation runs in one
+        parallel pass for unsigned short output. *photons* can also be a stack of images (N, y, x),
+        in which case the noise is applied to all of them at once and a stack is returned.
         """
         if self._last_input_shape != photons.shape:
+            if photons.shape[-2] % self.shape[0] or photons.shape[-1] % self.shape[1]:
+                raise ValueError(
+                    "Camera shape {} must be a divisor of the photons shape {}".format(
+                        self.shape, photons.shape
+                    )
+                )
             self._last_input_shape = photons.shape
-            self._bin_factor = (photons.shape[0] / self.shape[0], photons.shape[1] / self.shape[1])
+            self._bin_factor = (
+                photons.shape[-2] // self.shape[0],
+                photons.shape[-1] // self.shape[1],
+            )
 
         if queue is None:
             queue = cfg.OPENCL.queue
 
-        # Shot noise
-        # Adjust dark current for later binning and gain
-        dark = float(self.dark_current) / self._bin_factor[0] / self._bin_factor[1]
-        electrons = dark + gutil.get_host(photons)
-
         if self._bin_factor != (1, 1):
-            if psf:
-                sigma = (fwnm_to_sigma(self._bin_factor[0]), fwnm_to_sigma(self._bin_factor[1]))
-                small = decimate(electrons, self.shape, sigma=sigma, queue=queue)
+            if photons.ndim == 3:
+                # Binning works on single images, device frames must not have an offset
+                if isinstance(photons, cl_array.Array):
+                    frames = [photons[i].copy() for i in range(photons.shape[0])]
+                else:
+                    frames = photons
+                photons = cl_array.stack(
+                    [self._bin(frame, psf, queue) for frame in frames], queue=queue
+                )
             else:
-                small = bin_image(electrons, self.shape, queue=queue)
-            electrons = gutil.get_host(small)
+                photons = self._bin(photons, psf, queue)
+
+        if isinstance(photons, cl_array.Array) and np.dtype(self.dtype) == np.ushort:
+            # Data are on the device already, apply the noise there and transfer only the counts
+            return self._get_image_gpu(photons, shot_noise, amplifier_noise, queue).get()
+
+        if self.use_numba and np.dtype(self.dtype) == np.ushort:
+            photons = np.ascontiguousarray(gutil.get_host(photons))
+            if shot_noise and photons.min() + self.dark_current < 0:
+                # Same error as numpy's poisson, the numba kernel cannot raise it itself
+                raise ValueError("lam < 0")
+            out = np.empty(photons.shape, dtype=np.ushort)
+            sigma = self.amplifier_sigma if amplifier_noise else 0
+            _emva_numba(
+                photons,
+                out,
+                self.dark_current,
+                float(self.gain),
+                float(sigma),
+                float(self.max_grey_value),
+                bool(shot_noise),
+            )
+            return out
+
+        # All noise is applied in-place on one array in order to avoid sensor-sized temporaries,
+        # the sensor output has at most 16 bits, so single precision is enough
+        electrons = np.add(gutil.get_host(photons), self.dark_current, dtype=cfg.PRECISION.np_float)
 
         if shot_noise:
-            electrons = np.random.poisson(electrons)
+            _apply_shot_noise(electrons, self._rng)
 
         if amplifier_noise and self.amplifier_sigma > 0:
             # Add electronics noise
-            electrons = np.random.normal(electrons, self.amplifier_sigma)
+            noise = self._rng.standard_normal(electrons.shape, dtype=electrons.dtype)
+            noise *= self.amplifier_sigma
+            electrons += noise
 
-        counts = self.gain * electrons
+        electrons *= self.gain
 
         # Cut the values beyond the maximum represented grey value given by
-        # bytes per pixel.
-        counts[counts > self.max_grey_value] = self.max_grey_value
+        # bytes per pixel and the negative ones caused by the amplifier noise.
+        np.clip(electrons, 0, self.max_grey_value, out=electrons)
+
+        # Apply quantization noise, round to the nearest integer in order not to bias the counts
+        if np.issubdtype(self.dtype, np.integer):
+            np.rint(electrons, out=electrons)
+        return electrons.astype(self.dtype)
+
+    def _bin(self, photons, psf, queue):
+        """Bin 2D *photons* to the camera shape, if *psf* is True, filter them by a Gaussian with
+        the FWHM of one camera pixel first. Use command *queue* and return a pyopencl Array.
+        """
+        if psf:
+            sigma = (fwnm_to_sigma(self._bin_factor[0]), fwnm_to_sigma(self._bin_factor[1]))
+            return decimate(photons, self.shape, sigma=sigma, queue=queue)
+
+        return bin_image(photons, self.shape, queue=queue)
+
+    def _get_image_gpu(self, photons, shot_noise, amplifier_noise, queue):
+        """Apply dark current, noise and clipping to *photons* pyopencl Array in one kernel and use
+        command *queue*. Return a pyopencl Array with unsigned short counts.
+        """
+        if photons.dtype != cfg.PRECISION.np_float:
+            photons = photons.astype(cfg.PRECISION.np_float)
+        elif photons.offset or not photons.flags.c_contiguous:
+            # The kernel reads a dense buffer from its start, pyopencl refuses to copy strided
+            # arrays, so they raise an error instead of being read wrongly
+            photons = photons.copy()
+        out = cl_array.Array(queue, photons.shape, dtype=np.ushort)
+        seed = self._rng.integers(np.iinfo(np.uint64).max, dtype=np.uint64)
+
+        # Stacks of images are processed as one tall image
+        cfg.OPENCL.programs["cameras"].emva_noise(
+            queue,
+            (photons.shape[-1], photons.size // photons.shape[-1]),
+            None,
+            photons.data,
+            out.data,
+            cfg.PRECISION.np_float(self.gain),
+            cfg.PRECISION.np_float(self.dark_current),
+            cfg.PRECISION.np_float(self.amplifier_sigma),
+            np.ushort(self.max_grey_value),
+            seed,
+            np.int32(shot_noise),
+            np.int32(amplifier_noise and self.amplifier_sigma > 0),
+        )
 
-        # Apply quantization noise
-        return counts.astype(self.dtype)
+        return out
 
 
 def make_pco_dimax():
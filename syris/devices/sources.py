@@ -139,7 +139,13 @@ class XRaySource(OpticalElement):
         fwhm = (distance * self.size / self.sample_distance).simplified
         sigma = smath.fwnm_to_sigma(fwhm, n=2)
         psf = ip.get_gauss_2d(
-            intensity.shape, sigma, pixel_size=pixel_size, fourier=True, queue=queue, block=block
+            intensity.shape,
+            sigma,
+            pixel_size=pixel_size,
+            fourier=True,
+            queue=queue,
+            block=block,
+            cache=True,
         )
 
         return ip.ifft_2(ip.fft_2(intensity) * psf).real
@@ -0,0 +1,157 @@
+/*
+ * Camera routines on OpenCL.
+ *
+ * Requires definition of vfloat data type, which defines single or double
+ * precision for floating point numbers.
+ */
+
+/* Below this mean the Poisson distribution is sampled exactly by Knuth's
+ * multiplication method, above it the Gaussian approximation is used. */
+#define POISSON_GAUSS_LIMIT 30.0f
+
+#define PHILOX_M4x32_0 0xD2511F53u
+#define PHILOX_M4x32_1 0xCD9E8D57u
+#define PHILOX_W32_0 0x9E3779B9u
+#define PHILOX_W32_1 0xBB67AE85u
+
+
+/*
+ * Counter-based random number generator state of one work item. One Philox
+ * call gives four random numbers, the second pair is kept in *cache* for the
+ * next draw.
+ */
+typedef struct {
+    uint4 counter;
+    uint2 key;
+    uint2 cache;
+    int cached;
+} philox_state;
+
+
+/*
+ * Philox4x32-10 bijection, see Salmon et al., Parallel random numbers: as easy
+ * as 1, 2, 3, SC 2011.
+ */
+static uint4 philox4x32_10(uint4 counter, uint2 key)
+{
+    uint hi_0, lo_0, hi_1, lo_1;
+
+    for (int i = 0; i < 10; i++) {
+        hi_0 = mul_hi(PHILOX_M4x32_0, counter.x);
+        lo_0 = PHILOX_M4x32_0 * counter.x;
+        hi_1 = mul_hi(PHILOX_M4x32_1, counter.z);
+        lo_1 = PHILOX_M4x32_1 * counter.z;
+        counter = (uint4) (hi_1 ^ counter.y ^ key.x, lo_1, hi_0 ^ counter.w ^ key.y, lo_0);
+        key += (uint2) (PHILOX_W32_0, PHILOX_W32_1);
+    }
+
+    return counter;
+}
+
+
+/*
+ * Get two uniformly distributed random numbers from the interval (0, 1].
+ */
+static float2 next_uniform2(philox_state *state)
+{
+    uint2 bits;
+    uint4 block;
+
+    if (state->cached) {
+        bits = state->cache;
+        state->cached = 0;
+    } else {
+        block = philox4x32_10(state->counter, state->key);
+        state->counter.z++;
+        bits = block.xy;
+        state->cache = block.zw;
+        state->cached = 1;
+    }
+
+    return (convert_float2(bits >> 8) + 1.0f) * 0x1.0p-24f;
+}
+
+
+/*
+ * Get a random number from the standard normal distribution (Box-Muller).
+ */
+static vfloat next_normal(philox_state *state)
+{
+    float2 u = next_uniform2(state);
+
+    return sqrt(-2.0f * log(u.x)) * cospi(2.0f * u.y);
+}
+
+
+/*
+ * Get a Poisson-distributed random number with mean *lambda*.
+ */
+static vfloat next_poisson(philox_state *state, vfloat lambda)
+{
+    float2 u;
+    float limit, product = 1.0f;
+    int k = 0;
+
+    if (lambda <= 0) {
+        return 0;
+    }
+    if (lambda >= POISSON_GAUSS_LIMIT) {
+        return fmax(rint(lambda + sqrt(lambda) * next_normal(state)), (vfloat) 0);
+    }
+
+    limit = exp(-(float) lambda);
+    while (1) {
+        u = next_uniform2(state);
+        product *= u.x;
+        if (product <= limit) {
+            break;
+        }
+        k++;
+        product *= u.y;
+        if (product <= limit) {
+            break;
+        }
+        k++;
+    }
+
+    return k;
+}
+
+
+/*
+ * Convert incoming *photons* to digital counts with noise based on the EMVA 1288
+ * standard. *dark* is the mean number of dark electrons, *gain* converts
+ * electrons to counts, *sigma* is the amplifier noise standard deviation in
+ * electrons and the result is clipped to *max_val*. Shot noise and amplifier
+ * noise are applied only if *shot_noise* and *amplifier_noise* are non-zero.
+ * The counts are rounded to the nearest integer.
+ * Every work item draws its random numbers from its own Philox stream given by
+ * its global index and the full 64 bits of *seed*.
+ */
+__kernel void emva_noise(__global const vfloat *photons,
+                         __global ushort *out,
+                         const vfloat gain,
+                         const vfloat dark,
+                         const vfloat sigma,
+                         const ushort max_val,
+                         const ulong seed,
+                         const int shot_noise,
+                         const int amplifier_noise)
+{
+    size_t index = get_global_id(1) * get_global_size(0) + get_global_id(0);
+    /* The pixel index and the draw number form the counter, the whole seed is the key */
+    philox_state state = {(uint4) ((uint) index, (uint) ((ulong) index >> 32), 0, 0),
+                          (uint2) ((uint) seed, (uint) (seed >> 32)),
+                          (uint2) (0, 0),
+                          0};
+    vfloat electrons = photons[index] + dark;
+
+    if (shot_noise) {
+        electrons = next_poisson(&state, electrons);
+    }
+    if (amplifier_noise) {
+        electrons += sigma * next_normal(&state);
+    }
+
+    out[index] = convert_ushort_sat_rte(clamp(gain * electrons, (vfloat) 0, (vfloat) max_val));
+}
@@ -7,33 +7,26 @@
 
 
 /*
- * 2D Gaussian in real space.
+ * 1D Gaussian in real space, a 2D Gaussian is an outer product of two of them.
  */
-__kernel void gauss_2d(__global vfloat *out, const vfloat2 sigma, const vfloat2 pixel_size) {
+__kernel void gauss_1d(__global vfloat *out, const vfloat sigma, const vfloat pixel_size) {
     int ix = get_global_id(0);
-    int iy = get_global_id(1);
     int width = get_global_size(0);
-    int height = get_global_size(1);
 
-    vfloat x = ix < width / 2 + width % 2 ? ix * pixel_size.x : (ix - width) * pixel_size.x;
-    vfloat y = iy < height / 2 + height % 2 ? iy * pixel_size.y : (iy - height) * pixel_size.y;
+    vfloat x = ix < width / 2 + width % 2 ? ix * pixel_size : (ix - width) * pixel_size;
 
-    out[iy * width + ix] = exp (- x * x / (2 * sigma.x * sigma.x) - y * y / (2 * sigma.y * sigma.y));
+    out[ix] = exp (- x * x / (2 * sigma * sigma));
 }
 
 /*
- * 2D Gaussian in Fourier space.
+ * 1D Gaussian in Fourier space, a 2D Gaussian is an outer product of two of them.
  */
-__kernel void gauss_2d_f(__global vfloat *out, const vfloat2 sigma, const vfloat2 pixel_size) {
+__kernel void gauss_1d_f(__global vfloat *out, const vfloat sigma, const vfloat pixel_size) {
     int ix = get_global_id(0);
-    int iy = get_global_id(1);
     int width = get_global_size(0);
-    int height = get_global_size(1);
 
-    vfloat i = (ix < width / 2 + width % 2 ? ix / pixel_size.x :
-                (ix - width) / pixel_size.x) / ((float) width);
-    vfloat j = (iy < height / 2 + height % 2 ? iy / pixel_size.y :
-                (iy - height) / pixel_size.y) / ((float) height);
+    vfloat i = (ix < width / 2 + width % 2 ? ix / pixel_size :
+                (ix - width) / pixel_size) / ((float) width);
 
 	/* Fourier transform of a Gaussian is a stretched Gaussian.
 	 * We assume a Gaussian with standard deviation c to be
@@ -47,11 +40,21 @@ __kernel void gauss_2d_f(__global vfloat *out, const vfloat2 sigma, const vfloat
 	 * the fourier transform of a gaussian g(x) is
 	 *
 	 * $G(xi) = e ^ {- 2 * \pi ^ 2 * c ^ 2 * xi ^ 2}.$
-	 *
-	 * The description is for brevity for 1D case.
 	 */
-    out[iy * width + ix] = exp(- 2 * M_PI * M_PI * (sigma.x * sigma.x * i * i +
-                                                    sigma.y * sigma.y * j * j));
+    out[ix] = exp(- 2 * M_PI * M_PI * sigma * sigma * i * i);
+}
+
+/*
+ * Outer product of vectors *y* and *x*, i.e. out[j, i] = y[j] * x[i].
+ */
+__kernel void outer_product(__global vfloat *out,
+                            __global const vfloat *y,
+                            __global const vfloat *x) {
+    int ix = get_global_id(0);
+    int iy = get_global_id(1);
+    int width = get_global_size(0);
+
+    out[iy * width + ix] = y[iy] * x[ix];
 }
 
 /*
@@ -111,3 +114,29 @@ __kernel void compute_intensity (__global vcomplex *wavefield,
 
     out[index] = value.x * value.x + value.y * value.y;
 }
+
+/*
+ * Store real *in* as complex numbers with zero imaginary part in *out*.
+ */
+__kernel void make_complex (__global const vfloat *in,
+                            __global vcomplex *out)
+{
+    int ix = get_global_id (0);
+    int iy = get_global_id (1);
+    int index = iy * get_global_size(0) + ix;
+
+    out[index] = (vcomplex) (in[index], 0);
+}
+
+/*
+ * Store the real part of complex *in* in *out*.
+ */
+__kernel void get_real_part (__global const vcomplex *in,
+                             __global vfloat *out)
+{
+    int ix = get_global_id (0);
+    int iy = get_global_id (1);
+    int index = iy * get_global_size(0) + ix;
+
+    out[index] = in[index].x;
+}
@@ -48,6 +48,7 @@ def init_programs():
     cfg.OPENCL.programs["physics"] = get_program(get_source(["vcomplex.cl", "physics.cl"]))
     cfg.OPENCL.programs["geometry"] = get_program(get_metaobjects_source())
     cfg.OPENCL.programs["mesh"] = get_program(get_source(["heapsort.cl", "mesh.cl"]))
+    cfg.OPENCL.programs["cameras"] = get_program(get_source(["cameras.cl"]))
     cfg.OPENCL.programs["varconv"] = get_program(get_all_varconvolutions())
 
 
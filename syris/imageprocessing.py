@@ -1,6 +1,7 @@
 """Module for GPU-based image processing."""
 import itertools
 import logging
+from collections import OrderedDict
 import numpy as np
 import pyopencl as cl
 import pyopencl.array as cl_array
@@ -19,7 +20,8 @@ LOG = logging.getLogger(__name__)
 def fft_2(data, queue=None, block=True):
     """2D FFT executed on *data*. *block* specifies if the execution will wait until the scheduled
     FFT kernels finish. The transformation is done in-place if *data* is a pyopencl Array class and
-    has complex data type, otherwise the data is converted first.
+    has complex data type, otherwise the data is converted first. If *data* is 3D, it is treated as
+    a stack of 2D images (batch, y, x) which are all transformed by one plan in one execution.
     """
     return _fft_2(data, inverse=False, queue=queue, block=block)
 
@@ -27,7 +29,9 @@ def fft_2(data, queue=None, block=True):
 def ifft_2(data, queue=None, block=True):
     """2D inverse FFT executed on *data*. *block* specifies if the execution will wait until the
     scheduled FFT kernels finish. The transformation is done in-place if *data* is a pyopencl Array
-    class and has complex data type, otherwise the data is converted first.  """
+    class and has complex data type, otherwise the data is converted first. 3D *data* is
+    transformed as a stack of 2D images (batch, y, x), see :func:`fft_2`.
+    """
     return _fft_2(data, inverse=True, queue=queue, block=block)
 
 
@@ -46,7 +50,8 @@ def _fft_2(data, inverse=False, queue=None, block=True):
         cfg.OPENCL.fft_plans[queue] = {}
     if data.shape not in cfg.OPENCL.fft_plans[queue]:
         LOG.debug("Creating FFT Plan for {} and shape {}".format(queue, data.shape))
-        _fft = FFT(data, axes=(0, 1))
+        # Transform the last two axes, the first one of 3D data is the batch
+        _fft = FFT(data, axes=(data.ndim - 2, data.ndim - 1))
         cfg.OPENCL.fft_plans[queue][data.shape] = _fft.compile(thread, fast_math=False)
     plan = cfg.OPENCL.fft_plans[queue][data.shape]
 
@@ -59,10 +64,13 @@ def _fft_2(data, inverse=False, queue=None, block=True):
     return data
 
 
-def get_gauss_2d(shape, sigma, pixel_size=1, fourier=False, queue=None, block=False):
+def get_gauss_2d(shape, sigma, pixel_size=1, fourier=False, queue=None, block=False, cache=False):
     """Get 2D Gaussian of *shape* with standard deviation *sigma* and *pixel_size*. If *fourier* is
     True the fourier transform of it is returned so it is faster for usage by convolution. Use
-    command *queue* if specified. If *block* is True, wait for the kernel to finish.
+    command *queue* if specified. If *block* is True, wait for the kernel to finish. If *cache* is
+    True, the Gaussian is stored per command queue and returned by subsequent calls with the same
+    parameters without being computed again, in which case it must not be modified by the caller.
+    At most :data:`syris.config.MAX_GAUSS_FILTERS` least recently used filters are kept.
     """
     shape = make_tuple(shape)
     pixel_size = get_magnitude(make_tuple(pixel_size))
@@ -77,28 +85,45 @@ def get_gauss_2d(shape, sigma, pixel_size=1, fourier=False, queue=None, block=Fa
 
     if queue is None:
         queue = cfg.OPENCL.queue
+    if cache:
+        key = (
+            tuple(shape),
+            tuple([float(value) for value in sigma]),
+            tuple([float(value) for value in pixel_size]),
+            fourier,
+        )
+        if queue not in cfg.OPENCL.gauss_filters:
+            cfg.OPENCL.gauss_filters[queue] = OrderedDict()
+        filters = cfg.OPENCL.gauss_filters[queue]
+        if key in filters:
+            filters.move_to_end(key)
+            return filters[key]
     out = cl.array.Array(queue, shape, dtype=cfg.PRECISION.np_float)
 
-    if fourier:
-        ev = cfg.OPENCL.programs["improc"].gauss_2d_f(
+    # The 2D Gaussian is separable, so compute the exponentials only along the two axes and combine
+    # them by their outer product
+    kernel = "gauss_1d_f" if fourier else "gauss_1d"
+    profiles = []
+    for i in range(2):
+        profile = cl.array.Array(queue, (shape[i],), dtype=cfg.PRECISION.np_float)
+        getattr(cfg.OPENCL.programs["improc"], kernel)(
             queue,
-            shape[::-1],
+            (shape[i],),
             None,
-            out.data,
-            g_util.make_vfloat2(sigma[1], sigma[0]),
-            g_util.make_vfloat2(pixel_size[1], pixel_size[0]),
-        )
-    else:
-        ev = cfg.OPENCL.programs["improc"].gauss_2d(
-            queue,
-            shape[::-1],
-            None,
-            out.data,
-            g_util.make_vfloat2(sigma[1], sigma[0]),
-            g_util.make_vfloat2(pixel_size[1], pixel_size[0]),
+            profile.data,
+            cfg.PRECISION.np_float(sigma[i]),
+            cfg.PRECISION.np_float(pixel_size[i]),
         )
+        profiles.append(profile)
+    ev = cfg.OPENCL.programs["improc"].outer_product(
+        queue, shape[::-1], None, out.data, profiles[0].data, profiles[1].data
+    )
     if block:
         ev.wait()
+    if cache:
+        filters[key] = out
+        if len(filters) > cfg.MAX_GAUSS_FILTERS:
+            filters.popitem(last=False)
 
     return out
 
@@ -237,7 +262,7 @@ def decimate(image, shape, sigma=None, average=False, queue=None, block=False):
         average,
     )
 
-    fltr = get_gauss_2d(image.shape, sigma, fourier=True, queue=queue, block=block)
+    fltr = get_gauss_2d(image.shape, sigma, fourier=True, queue=queue, block=block, cache=True)
     image = image.astype(cfg.PRECISION.np_cplx)
     fft_2(image, queue=queue, block=block)
     image *= fltr
@@ -251,7 +276,7 @@ def blur_with_gaussian(image, sigma, queue=None, block=False):
     """Blur *image* with a gaussian kernel, where *sigma* is the standard deviation. Use command
     *queue*, if *block* is True, wait for the copy to finish.
     """
-    fltr = get_gauss_2d(image.shape, sigma, fourier=True, queue=queue, block=block)
+    fltr = get_gauss_2d(image.shape, sigma, fourier=True, queue=queue, block=block, cache=True)
     image = image.astype(cfg.PRECISION.np_cplx)
     image = fft_2(image, queue=queue, block=block)
     image *= fltr
@@ -260,6 +285,68 @@ def blur_with_gaussian(image, sigma, queue=None, block=False):
     return image.real
 
 
+class ImageProcessor(object):
+
+    """Filtering of many images with the same shape. The complex scratch buffer, the FFT plan and
+    the filters are created once and reused by all calls.
+    """
+
+    def __init__(self, shape, queue=None):
+        """Create an image processor for images of *shape* (y, x) which uses command *queue*."""
+        if queue is None:
+            queue = cfg.OPENCL.queue
+        self.shape = tuple([int(n) for n in make_tuple(shape)])
+        self.queue = queue
+        self._tmp = cl_array.Array(queue, self.shape, dtype=cfg.PRECISION.np_cplx)
+
+    def filter_gauss(self, image, sigma, pixel_size=1, out=None, block=False):
+        """Blur *image* with a Gaussian with standard deviation *sigma* and *pixel_size* by
+        multiplication in the Fourier space, which is done in-place in the scratch buffer. *out* is
+        the pyopencl Array instance for the real part of the result, if not specified it will be
+        created. *out* is also returned. If *block* is True, wait for the filtering to finish.
+        """
+        if image.shape != self.shape:
+            raise ValueError(
+                "Image shape {} differs from the processor shape {}".format(image.shape, self.shape)
+            )
+        if out is None:
+            out = cl_array.Array(self.queue, self.shape, dtype=cfg.PRECISION.np_float)
+        elif out.shape != self.shape or out.dtype != cfg.PRECISION.np_float or out.offset:
+            raise ValueError(
+                "out must have shape {}, dtype {} and no offset".format(
+                    self.shape, np.dtype(cfg.PRECISION.np_float)
+                )
+            )
+        image = g_util.get_array(image, queue=self.queue)
+        # The kernels read the buffer in the current precision from its start
+        dtype = cfg.PRECISION.np_cplx if image.dtype.kind == "c" else cfg.PRECISION.np_float
+        if image.dtype != dtype:
+            image = image.astype(dtype)
+        elif image.offset:
+            image = image.copy()
+        fltr = get_gauss_2d(
+            self.shape, sigma, pixel_size=pixel_size, fourier=True, queue=self.queue, cache=True
+        )
+        LOG.debug("ImageProcessor.filter_gauss, shape: %s, sigma: %s", self.shape, sigma)
+
+        if image.dtype == cfg.PRECISION.np_cplx:
+            cl.enqueue_copy(self.queue, self._tmp.data, image.data)
+        else:
+            cfg.OPENCL.programs["improc"].make_complex(
+                self.queue, self.shape[::-1], None, image.data, self._tmp.data
+            )
+        fft_2(self._tmp, queue=self.queue, block=False)
+        self._tmp *= fltr
+        ifft_2(self._tmp, queue=self.queue, block=False)
+        ev = cfg.OPENCL.programs["improc"].get_real_part(
+            self.queue, self.shape[::-1], None, self._tmp.data, out.data
+        )
+        if block:
+            ev.wait()
+
+        return out
+
+
 def rescale(image, shape, sampler=None, queue=None, out=None, block=False):
     """Rescale *image* to *shape* and use *sampler* which is a :class:`pyopencl.Sampler` instance.
     Use OpenCL *queue* and *out* pyopencl Array. If *block* is True, wait for the copy to finish.
@@ -423,11 +510,23 @@ def _check_tiling(shape, tiles_count):
         raise ValueError("shape must be a multiple of tile shape.")
 
 
+def _get_integer(value, name):
+    """Convert *value* to an integer, raise ValueError with parameter *name* in the message if it is
+    not integral.
+    """
+    if int(value) != value:
+        raise ValueError("{} must be integral, got {}".format(name, value))
+
+    return int(value)
+
+
 class Tiler(object):
 
-    """Class for breaking images into smaller tiles."""
+    """Class for breaking images into smaller tiles. A tiler can be reused for many images, use
+    :meth:`.reset` to clear the overall image and :meth:`.retile` to change the tiling.
+    """
 
-    def __init__(self, shape, tiles_count, outlier=True, supersampling=1, cplx=False):
+    def __init__(self, shape, tiles_count, outlier=True, supersampling=1, cplx=False, queue=None):
         """
         Create image tiler for a region of *shape* (y, x) to tiles with (y, x)
         *tiles_count*. If *outlier* is True we want to include outlier regions
@@ -435,21 +534,43 @@ class Tiler(object):
         with FFT outlier artifacts). *Supersampling* determines
         the coeffiecient by which the resulting image dimensions will be
         multiplied. If *cplx* is True, the resulting overall image will
-        be complex.
+        be complex. If OpenCL command *queue* is specified, the overall image
+        is a :class:`pyopencl.array.Array` and tiles are stitched on its device.
         """
-        _check_tiling(shape, tiles_count)
+        self._outlier_coeff = 2 if outlier else 1
+        self.supersampling = _get_integer(supersampling, "supersampling")
+        self._dtype = cfg.PRECISION.np_cplx if cplx else cfg.PRECISION.np_float
+        self._queue = queue
+        self.tiles_count = None
+        self.shape = None
+        self._overall = None
+        self.retile(shape, tiles_count)
+
+    def retile(self, shape, tiles_count):
+        """Change the tiled region *shape* (y, x) and the (y, x) *tiles_count*. The tiling is
+        checked and the overall image is reallocated only if they differ from the current ones.
+        """
+        # Integers make sure that all the tile shapes and indices can be used for slicing directly
+        tiles_count = tuple([_get_integer(n, "tiles_count") for n in tiles_count])
+        supersampled = (shape[0] * self.supersampling, shape[1] * self.supersampling)
+        if supersampled == self.shape and tiles_count == self.tiles_count:
+            return
 
+        _check_tiling(shape, tiles_count)
         self.tiles_count = tiles_count
-        self._outlier_coeff = 2 if outlier else 1
-        self.supersampling = supersampling
-        self.shape = (shape[0] * self.supersampling, shape[1] * self.supersampling)
+        shape = supersampled
 
-        ar_type = cfg.PRECISION.np_cplx if cplx else cfg.PRECISION.np_float
+        if shape != self.shape:
+            self.shape = shape
+            overall_shape = (shape[0] // self.supersampling, shape[1] // self.supersampling)
+            if self._queue is None:
+                self._overall = np.empty(overall_shape, dtype=self._dtype)
+            else:
+                self._overall = cl_array.Array(self._queue, overall_shape, dtype=self._dtype)
 
-        self._overall = np.empty(
-            (self.shape[0] // self.supersampling, self.shape[1] // self.supersampling),
-            dtype=ar_type,
-        )
+    def reset(self):
+        """Set the overall image to zero without reallocating it."""
+        self._overall.fill(0)
 
     @property
     def result_tile_shape(self):
@@ -469,6 +590,7 @@ class Tiler(object):
         """Get the supersampled tile shape based on tile counts
         *tile_counts* as (y, x) and *shape* (y, x).
         """
+        # Not rounded to mixed-radix sizes, the reikna FFT is fast only for powers of two
         return (
             self._outlier_coeff * self.shape[0] // self.tiles_count[0],
             self._outlier_coeff * self.shape[1] // self.tiles_count[1],
@@ -479,21 +601,20 @@ class Tiler(object):
         """Get the supersampled tile indices which are starting points
         of a given tile in (y, x) fashion.
         """
-        y_ind = np.array(
-            [i * self.tile_shape[0] // self._outlier_coeff for i in range(self.tiles_count[0])]
-        )
-        x_ind = np.array(
-            [i * self.tile_shape[1] // self._outlier_coeff for i in range(self.tiles_count[1])]
-        )
+        tile_shape = self.tile_shape
+        y_ind = np.arange(self.tiles_count[0]) * tile_shape[0] // self._outlier_coeff
+        x_ind = np.arange(self.tiles_count[1]) * tile_shape[1] // self._outlier_coeff
 
         if self.outlier:
             # If the tile starts at x and has a shape n, then with outlier
             # treatment it starts at x - n / 2 and ends in x + n / 2, thus
             # has shape 2 * n
-            y_ind = y_ind - self.tile_shape[0] // 4
-            x_ind = x_ind - self.tile_shape[1] // 4
+            y_ind -= tile_shape[0] // 4
+            x_ind -= tile_shape[1] // 4
+
+        y_ind, x_ind = np.meshgrid(y_ind, x_ind, indexing="ij")
 
-        return np.array(list(itertools.product(y_ind, x_ind))).reshape(self.tiles_count + (2,))
+        return np.stack([y_ind, x_ind], axis=-1)
 
     def average(self, tile, out=None):
         """Average :class:`pyopencl.array.Array` *tile* based on supersampling and outlier specified
@@ -504,17 +625,41 @@ class Tiler(object):
 
         return bin_image(tile, summed_shape, offset, average=True, out=out)
 
-    def insert(self, tile, indices):
+    def insert(self, tile, indices, block=False):
         """Insert a non-supersampled, outlier-free *tile* into the overall
-        image. *indices* (y, x) are tile indices in the overall image.
+        image. *indices* (y, x) are tile indices in the overall image. If the
+        overall image is on the device, the tile is copied there by a
+        rectangular buffer copy and if *block* is True, wait for it to finish.
         """
         # Get rid of supersampling and outlier.
         tile_shape = self.result_tile_shape
 
-        self._overall[
+        if self._queue is not None:
+            if tuple(tile.shape) != tile_shape:
+                raise ValueError(
+                    "Tile shape {} differs from the result tile shape {}".format(
+                        tile.shape, tile_shape
+                    )
+                )
+            tile = g_util.get_array(tile, queue=self._queue)
+            if tile.dtype != self._overall.dtype:
+                tile = tile.astype(self._overall.dtype)
+            elif tile.offset:
+                # The rectangular copy reads the buffer from its start
+                tile = tile.copy()
+            n_bytes = tile.dtype.itemsize
+            dst_origin = (n_bytes * indices[1] * tile_shape[1], indices[0] * tile_shape[0], 0)
+            region = (n_bytes * tile_shape[1], tile_shape[0], 1)
+            _copy_rect(tile, self._overall, (0, 0, 0), dst_origin, region, self._queue, block=block)
+            return
+
+        # The copy runs row by row over contiguous overall image rows, splitting the tile into
+        # smaller blocks does not make it faster
+        region = self._overall[
             indices[0] * tile_shape[0] : tile_shape[0] * (indices[0] + 1),
             indices[1] * tile_shape[1] : tile_shape[1] * (indices[1] + 1),
-        ] = tile
+        ]
+        np.copyto(region, g_util.get_host(tile), casting="unsafe")
 
 
 def make_tile_offsets(shape, tile_shape, outlier=(0, 0)):
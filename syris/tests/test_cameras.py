@@ -1,7 +1,10 @@
 import numpy as np
+import pyopencl.array as cl_array
 import quantities as q
+import unittest
+from unittest import mock
 import syris.config as cfg
-from syris.devices.cameras import Camera, is_fps_feasible
+from syris.devices.cameras import Camera, is_fps_feasible, njit
 from syris.tests import default_syris_init, SyrisTest
 
 
@@ -35,6 +38,29 @@ class TestCamera(SyrisTest):
         self.assertEqual(cam.exp_time, 0.5 * q.s)
         self.assertEqual(cam.fps, 1 / q.s)
 
+    def test_dark_current(self):
+        self.camera.dark_current = 5 * q.dimensionless
+        self.assertEqual(self.camera.dark_current, 5.0)
+        self.assertEqual(type(self.camera.dark_current), float)
+
+    def test_quantum_efficiencies(self):
+        wavelengths = np.linspace(400, 800, 20) * q.nm
+        qe = np.linspace(0, 1, 20) ** 2
+        order = np.random.permutation(len(wavelengths))
+        camera = Camera(
+            1 * q.um,
+            0.1,
+            10,
+            1,
+            12,
+            None,
+            wavelengths=wavelengths[order],
+            quantum_efficiencies=qe[order],
+        )
+        np.testing.assert_equal(camera.wavelengths.rescale(q.nm).magnitude, wavelengths.magnitude)
+        np.testing.assert_equal(camera.quantum_efficiencies, qe)
+        np.testing.assert_almost_equal(camera.get_quantum_efficiency(wavelengths), qe)
+
     def test_is_fps_feasible(self):
         self.assertTrue(is_fps_feasible(1000 / q.s, 1 * q.ms))
         self.assertTrue(is_fps_feasible(1000 / q.s, 0.5 * q.ms))
@@ -48,6 +74,15 @@ class TestCamera(SyrisTest):
         self.camera.exp_time = 10 * q.s
         self.assertAlmostEqual(0.1, self.camera.fps.simplified.magnitude)
 
+    def test_timing_floats(self):
+        self.camera.fps = 1000 / q.s
+        self.assertEqual(self.camera.fps_hertz, 1000.0)
+        self.assertAlmostEqual(self.camera.exp_time_seconds, 1e-3)
+        self.camera.exp_time = 100 * q.ms
+        self.assertAlmostEqual(self.camera.fps_hertz, 10.0)
+        self.assertAlmostEqual(self.camera.exp_time_seconds, 0.1)
+        self.assertEqual(type(self.camera.exp_time_seconds), float)
+
     def test_bpp(self):
         self.assertEqual(self.camera.max_grey_value, 2 ** self.camera.bpp - 1)
 
@@ -58,6 +93,89 @@ class TestCamera(SyrisTest):
         self.assertNotEqual(np.var(res), 0.0)
         self.assertNotEqual(np.sum(res), 0.0)
 
+    def test_shot_noise(self):
+        for lam in [5, 100]:
+            photons = np.ones(self.camera.shape, dtype=cfg.PRECISION.np_float)
+            photons *= lam - self.camera.dark_current
+            res = self.camera.get_image(photons, shot_noise=True, psf=False)
+
+            self.assertAlmostEqual(np.mean(res) / lam, 1, delta=0.1)
+            self.assertAlmostEqual(np.var(res) / lam, 1, delta=0.1)
+
+    def test_clipping(self):
+        # Strong amplifier noise must not wrap around below zero
+        camera = Camera(1 * q.um, 1.0, 10.0, 50, 10, (64, 64))
+        photons = np.zeros(camera.shape, dtype=cfg.PRECISION.np_float)
+        res = camera.get_image(photons, shot_noise=False, psf=False)
+
+        self.assertGreater(np.sum(res == 0), 0)
+        self.assertLessEqual(res.max(), camera.max_grey_value)
+        self.assertLess(np.mean(res), camera.max_grey_value / 2)
+
+    def test_rounding(self):
+        photons = np.ones(self.camera.shape, dtype=cfg.PRECISION.np_float) * 0.6
+        gt = np.round(self.camera.dark_current + 0.6)
+        res = self.camera.get_image(photons, shot_noise=False, amplifier_noise=False, psf=False)
+        np.testing.assert_equal(res, gt)
+
+        photons = cl_array.to_device(cfg.OPENCL.queue, photons)
+        res = self.camera.get_image(photons, shot_noise=False, amplifier_noise=False, psf=False)
+        np.testing.assert_equal(res, gt)
+
+    def test_stack(self):
+        lam = 100
+        shape = (3,) + self.camera.shape
+        photons = np.ones(shape, dtype=cfg.PRECISION.np_float) * (lam - self.camera.dark_current)
+        photons[1] = 0
+        inputs = [photons, cl_array.to_device(cfg.OPENCL.queue, photons)]
+        for data in inputs:
+            res = self.camera.get_image(data, psf=False)
+            self.assertEqual(res.shape, shape)
+            self.assertAlmostEqual(np.mean(res[0]) / lam, 1, delta=0.1)
+            self.assertAlmostEqual(np.mean(res[1]) / self.camera.dark_current, 1, delta=0.1)
+            self.assertAlmostEqual(np.var(res[2]) / lam, 1, delta=0.1)
+            # Frames must have independent noise
+            self.assertNotEqual(np.sum(res[0] != res[2]), 0)
+
+        # Binning of every frame
+        photons = np.ones((2, 128, 128), dtype=cfg.PRECISION.np_float)
+        for psf in [False, True]:
+            res = self.camera.get_image(photons, shot_noise=False, psf=psf)
+            self.assertEqual(res.shape, (2,) + self.camera.shape)
+            np.testing.assert_equal(res[:, 16:-16, 16:-16], 4 + self.camera.dark_current)
+            res = self.camera.get_image(
+                cl_array.to_device(cfg.OPENCL.queue, photons), shot_noise=False, psf=psf
+            )
+            np.testing.assert_equal(res[:, 16:-16, 16:-16], 4 + self.camera.dark_current)
+
+    @unittest.skipIf(njit is None, "numba not installed")
+    def test_numba_noise(self):
+        self.camera.use_numba = True
+        self.test_dark()
+        self.test_shot_noise()
+        self.test_saturation()
+        self.test_rounding()
+        self.test_stack()
+
+        # Same error as numpy for negative means
+        photons = -np.ones(self.camera.shape, dtype=cfg.PRECISION.np_float) * 20
+        self.assertRaises(ValueError, self.camera.get_image, photons, psf=False)
+        self.camera.use_numba = False
+        self.assertRaises(ValueError, self.camera.get_image, photons, psf=False)
+
+    def test_numba_not_installed(self):
+        with mock.patch("syris.devices.cameras.njit", None):
+            self.assertRaises(
+                ImportError, Camera, 1 * q.um, 1.0, 10.0, 0, 10, (64, 64), use_numba=True
+            )
+            with self.assertRaises(ImportError):
+                self.camera.use_numba = True
+            self.assertFalse(self.camera.use_numba)
+
+    def test_invalid_input_shape(self):
+        photons = np.zeros((96, 96), dtype=cfg.PRECISION.np_float)
+        self.assertRaises(ValueError, self.camera.get_image, photons)
+
     def test_saturation(self):
         photons = (
             np.ones(self.camera.shape, dtype=cfg.PRECISION.np_float)
@@ -70,3 +188,62 @@ class TestCamera(SyrisTest):
 
         diff = np.ones(self.camera.shape) * self.camera.max_grey_value - res
         self.assertEqual(np.sum(diff), 0)
+
+    def test_dark_gpu(self):
+        photons = cl_array.zeros(cfg.OPENCL.queue, self.camera.shape, dtype=cfg.PRECISION.np_float)
+        res = self.camera.get_image(photons, shot_noise=True, psf=False)
+
+        self.assertEqual(res.dtype, np.ushort)
+        self.assertNotEqual(np.var(res), 0.0)
+        # Poisson distribution with mean equal to the dark current
+        self.assertAlmostEqual(np.mean(res) / self.camera.dark_current, 1, delta=0.1)
+        self.assertAlmostEqual(np.var(res) / self.camera.dark_current, 1, delta=0.1)
+
+    def test_shot_noise_gpu(self):
+        # Gaussian approximation regime
+        lam = 100
+        photons = np.ones(self.camera.shape, dtype=cfg.PRECISION.np_float)
+        photons = cl_array.to_device(cfg.OPENCL.queue, photons * (lam - self.camera.dark_current))
+        res = self.camera.get_image(photons, shot_noise=True, psf=False)
+
+        self.assertAlmostEqual(np.mean(res) / lam, 1, delta=0.1)
+        self.assertAlmostEqual(np.var(res) / lam, 1, delta=0.1)
+
+    def test_seed(self):
+        photons = np.ones((2,) + self.camera.shape, dtype=cfg.PRECISION.np_float) * 20
+        photons_dev = cl_array.to_device(cfg.OPENCL.queue, photons)
+        cameras = [Camera(1 * q.um, 1.0, 10.0, 5, 10, (64, 64), seed=42) for i in range(2)]
+        for data in [photons, photons_dev]:
+            first, second = [camera.get_image(data, psf=False) for camera in cameras]
+            np.testing.assert_equal(first, second)
+            # Frames differ within the sequence
+            self.assertNotEqual(np.sum(first[0] != first[1]), 0)
+
+        other = Camera(1 * q.um, 1.0, 10.0, 5, 10, (64, 64), seed=43)
+        self.assertNotEqual(np.sum(other.get_image(photons, psf=False) != first), 0)
+
+    def test_device_views(self):
+        shape = (3,) + self.camera.shape
+        photons = np.arange(np.prod(shape), dtype=cfg.PRECISION.np_float).reshape(shape) % 100
+        photons_dev = cl_array.to_device(cfg.OPENCL.queue, photons)
+        gt = np.round(photons[1] + self.camera.dark_current)
+        res = self.camera.get_image(
+            photons_dev[1], shot_noise=False, amplifier_noise=False, psf=False
+        )
+        np.testing.assert_equal(res, gt)
+
+        # Strided views cannot be read densely by the kernel
+        wide_shape = (self.camera.shape[0], 2 * self.camera.shape[1])
+        strided = cl_array.zeros(cfg.OPENCL.queue, wide_shape, cfg.PRECISION.np_float)[:, ::2]
+        self.assertRaises(RuntimeError, self.camera.get_image, strided, psf=False)
+
+    def test_saturation_gpu(self):
+        photons = (
+            np.ones(self.camera.shape, dtype=cfg.PRECISION.np_float)
+            * 10
+            * self.camera.max_grey_value
+        )
+        photons = cl_array.to_device(cfg.OPENCL.queue, photons)
+        res = self.camera.get_image(photons, shot_noise=False, psf=False)
+
+        np.testing.assert_equal(res, self.camera.max_grey_value)
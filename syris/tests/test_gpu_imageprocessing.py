@@ -60,6 +60,29 @@ class TestGPUImageProcessing(SyrisTest):
             self._test_gauss(shape, False)
             self._test_gauss(shape, True)
 
+    def test_gauss_cache(self):
+        shape = (64, 128)
+        sigma = (2, 4) * q.um
+        first = ip.get_gauss_2d(shape, sigma, self.pixel_size, fourier=True, cache=True)
+        second = ip.get_gauss_2d(shape, sigma, self.pixel_size, fourier=True, cache=True)
+        self.assertIs(first, second)
+        gt = ip.get_gauss_2d(shape, sigma, self.pixel_size, fourier=True).get()
+        np.testing.assert_almost_equal(second.get(), gt)
+
+        # Different parameters must not hit the cache
+        other = ip.get_gauss_2d(shape, sigma, self.pixel_size, fourier=False, cache=True)
+        self.assertIsNot(first, other)
+        # The least recently used filters are evicted
+        for i in range(cfg.MAX_GAUSS_FILTERS):
+            ip.get_gauss_2d(shape, (i + 1) * q.um, self.pixel_size, fourier=True, cache=True)
+        self.assertLessEqual(len(cfg.OPENCL.gauss_filters[cfg.OPENCL.queue]), cfg.MAX_GAUSS_FILTERS)
+        second = ip.get_gauss_2d(shape, sigma, self.pixel_size, fourier=True, cache=True)
+        self.assertIsNot(first, second)
+
+        # No caching by default
+        first = ip.get_gauss_2d(shape, sigma, self.pixel_size)
+        self.assertIsNot(first, ip.get_gauss_2d(shape, sigma, self.pixel_size))
+
     def test_sum(self):
         m = 8
         n = 16
@@ -81,6 +104,38 @@ class TestGPUImageProcessing(SyrisTest):
         self.assertRaises(RuntimeError, ip.bin_image, cl_im, (5, 8))
         self.assertRaises(RuntimeError, ip.bin_image, cl_im, (4, 7), offset=(2, 2))
 
+    def test_image_processor(self):
+        shape = (32, 64)
+        sigma = (2, 3) * q.um
+        processor = ip.ImageProcessor(shape)
+        out = cl_array.Array(cfg.OPENCL.queue, shape, dtype=cfg.PRECISION.np_float)
+        for i in range(2):
+            image = np.random.random(shape).astype(cfg.PRECISION.np_float)
+            gt = ip.blur_with_gaussian(
+                image, (2 * q.um / self.pixel_size, 3 * q.um / self.pixel_size)
+            ).get()
+            res = processor.filter_gauss(image, sigma, pixel_size=self.pixel_size, out=out)
+            self.assertIs(res, out)
+            np.testing.assert_almost_equal(res.get(), gt, decimal=5)
+        # Other precisions on the device
+        image = cl_array.to_device(cfg.OPENCL.queue, image.astype(np.float64))
+        res = processor.filter_gauss(image, sigma, pixel_size=self.pixel_size)
+        np.testing.assert_almost_equal(res.get(), gt, decimal=5)
+        res = processor.filter_gauss(image.astype(np.complex128), sigma, pixel_size=self.pixel_size)
+        np.testing.assert_almost_equal(res.get(), gt, decimal=5)
+
+        self.assertRaises(ValueError, processor.filter_gauss, np.zeros((8, 8)), sigma)
+        # Invalid outputs
+        image = np.zeros(shape, dtype=cfg.PRECISION.np_float)
+        other_dtype = np.float64 if cfg.PRECISION.is_single() else np.float32
+        outs = [
+            cl_array.Array(cfg.OPENCL.queue, (8, 8), dtype=cfg.PRECISION.np_float),
+            cl_array.Array(cfg.OPENCL.queue, shape, dtype=other_dtype),
+            cl_array.Array(cfg.OPENCL.queue, (2,) + shape, dtype=cfg.PRECISION.np_float)[1],
+        ]
+        for out in outs:
+            self.assertRaises(ValueError, processor.filter_gauss, image, sigma, out=out)
+
     def test_decimate(self):
         n = 16
         sigma = fwnm_to_sigma(1)
@@ -156,6 +211,13 @@ class TestGPUImageProcessing(SyrisTest):
         ip.ifft_2(data)
         np.testing.assert_almost_equal(orig, data.get().real, decimal=4)
 
+        # Batch of images
+        data = np.random.normal(100, 100, size=(3, 8, 4)).astype(cfg.PRECISION.np_float)
+        gt = np.fft.fft2(data)
+        res = ip.fft_2(data).get()
+        np.testing.assert_almost_equal(gt / gt.std(), res / gt.std(), decimal=4)
+        np.testing.assert_almost_equal(data, ip.ifft_2(res).get().real, decimal=4)
+
         # Test double precision
         default_syris_init(double_precision=True)
         data = gpu_util.get_array(
@@ -1,6 +1,7 @@
 import numpy as np
 import pyopencl.array as cl_array
 from syris import config as cfg
+from syris.gpu import util as g_util
 from syris.imageprocessing import Tiler
 from syris.tests import SyrisTest, default_syris_init
 
@@ -42,6 +43,18 @@ class TestImageTiling(SyrisTest):
 
         self.assertRaises(ValueError, Tiler, size, tiles_count, False)
 
+    def test_integer_tiling(self):
+        tiler = Tiler((16, 16), (2.0, 4.0), outlier=True, supersampling=2.0)
+        for dim in tiler.tile_shape + tiler.result_tile_shape + tiler.tiles_count:
+            self.assertEqual(type(dim), int)
+        self.assertEqual(tiler.tile_indices.dtype.kind, "i")
+
+    def test_non_integral_tiling(self):
+        self.assertRaises(ValueError, Tiler, (16, 16), (2.5, 4))
+        self.assertRaises(ValueError, Tiler, (16, 16), (2, 4), supersampling=1.5)
+        tiler = Tiler((16, 16), (2, 4))
+        self.assertRaises(ValueError, tiler.retile, (16, 16), (4, 2.5))
+
     def test_tile_shape(self):
         for size, tiles_count in self.data:
             tiler = Tiler(size, tiles_count, True)
@@ -118,6 +131,75 @@ class TestImageTiling(SyrisTest):
                         tile,
                     )
 
+    def test_insert_device(self):
+        shape = 16, 32
+        tiles_count = 4, 2
+        tile_shape = [shape[i] // tiles_count[i] for i in range(len(shape))]
+        gt = np.random.random(shape).astype(cfg.PRECISION.np_float)
+
+        for supersampling in [1, 2]:
+            tiler = Tiler(
+                shape,
+                tiles_count,
+                outlier=True,
+                supersampling=supersampling,
+                queue=cfg.OPENCL.queue,
+            )
+            self.assertTrue(isinstance(tiler.overall_image, cl_array.Array))
+            for j in range(tiles_count[0]):
+                for i in range(tiles_count[1]):
+                    tile = gt[
+                        j * tile_shape[0] : tile_shape[0] * (j + 1),
+                        i * tile_shape[1] : tile_shape[1] * (i + 1),
+                    ]
+                    # Mix device and host tiles
+                    if (i + j) % 2:
+                        tile = cl_array.to_device(cfg.OPENCL.queue, np.ascontiguousarray(tile))
+                    tiler.insert(tile, (j, i))
+            np.testing.assert_equal(tiler.overall_image.get(), gt)
+
+    def test_insert_device_view(self):
+        tiler = Tiler((16, 16), (2, 2), outlier=False, queue=cfg.OPENCL.queue)
+        stack = np.random.random((2, 8, 8)).astype(cfg.PRECISION.np_float)
+        stack_dev = cl_array.to_device(cfg.OPENCL.queue, stack)
+        # Tile with an offset
+        tiler.insert(stack_dev[1], (0, 1))
+        np.testing.assert_equal(tiler.overall_image.get()[:8, 8:], stack[1])
+
+        # Wrong tile shapes
+        for shape in [(4, 8), (16, 8)]:
+            tile = cl_array.zeros(cfg.OPENCL.queue, shape, cfg.PRECISION.np_float)
+            self.assertRaises(ValueError, tiler.insert, tile, (0, 0))
+
+    def test_reset(self):
+        for queue in [None, cfg.OPENCL.queue]:
+            tiler = Tiler((16, 16), (2, 2), outlier=False, queue=queue)
+            tiler.overall_image.fill(1)
+            overall = tiler.overall_image
+            tiler.reset()
+            self.assertIs(tiler.overall_image, overall)
+            np.testing.assert_equal(g_util.get_host(tiler.overall_image), 0)
+
+    def test_retile(self):
+        tiler = Tiler((16, 16), (2, 2), outlier=False, supersampling=2)
+        overall = tiler.overall_image
+
+        # Same parameters, nothing changes
+        tiler.retile((16, 16), (2, 2))
+        self.assertIs(tiler.overall_image, overall)
+
+        # Different tiles count, same overall image
+        tiler.retile((16, 16), (4, 2))
+        self.assertIs(tiler.overall_image, overall)
+        self.assertEqual(tiler.tile_shape, (8, 16))
+
+        # Different shape, new overall image
+        tiler.retile((32, 16), (4, 2))
+        self.assertEqual(tiler.overall_image.shape, (32, 16))
+        self.assertEqual(tiler.tile_shape, (16, 16))
+
+        self.assertRaises(ValueError, tiler.retile, (32, 16), (3, 2))
+
     def test_sum(self):
         for shape, tiles_count in self.data:
             tiler = Tiler(shape, tiles_count, outlier=False, supersampling=4)